@@ -1,20 +1,52 @@
 """Database helpers for the ML client."""
 
+from dataclasses import dataclass
+import functools
 import os
+from typing import Optional
 
 from dotenv import load_dotenv
 from pymongo import MongoClient
 
-load_dotenv()
 
+@dataclass(frozen=True)
+class Config:
+    """Connection settings, read from the environment (and .env) once."""
 
+    mongo_uri: Optional[str]
+    mongo_db_name: Optional[str]
+
+    @classmethod
+    def load(cls) -> "Config":
+        """Build a Config from the current environment."""
+        load_dotenv()
+        return cls(
+            mongo_uri=os.getenv("MONGO_URI"),
+            mongo_db_name=os.getenv("MONGO_DB_NAME"),
+        )
+
+
+CFG = Config.load()
+
+
+@functools.lru_cache(maxsize=1)
 def _get_mongo_client() -> MongoClient:
-    """Create and return a MongoClient based on MONGO_URI."""
-    mongo_uri = os.getenv("MONGO_URI")
+    """Create and return the process-wide MongoClient based on MONGO_URI.
+
+    The client is cached so every caller shares one connection pool instead
+    of paying for a new pool, server discovery and monitor threads each time.
+    """
+    mongo_uri = CFG.mongo_uri
     if not mongo_uri:
         raise RuntimeError("MONGO_URI environment variable is not set.")
 
-    client_kwargs = {}
+    client_kwargs = {
+        "maxPoolSize": 16,
+        "minPoolSize": 4,
+        "serverSelectionTimeoutMS": 5000,
+        # zlib ships with Python; snappy/zstd would need extra packages.
+        "compressors": "zlib",
+    }
     if "mongodb.net" in mongo_uri:
         client_kwargs["tlsAllowInvalidCertificates"] = True
 
@@ -24,7 +56,7 @@ def _get_mongo_client() -> MongoClient:
 def get_db():
     """Return the database selected by MONGO_DB_NAME."""
     client = _get_mongo_client()
-    db_name = os.getenv("MONGO_DB_NAME")
+    db_name = CFG.mongo_db_name
     if not db_name:
         raise RuntimeError("MONGO_DB_NAME environment variable is not set.")
     return client[db_name]
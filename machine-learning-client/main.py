@@ -2,23 +2,104 @@
 
 from __future__ import annotations
 
+import hashlib
 import math
 import os
 import subprocess
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
 import soundfile as sf
 import torch
+import torchaudio
 import torchcrepe
 
 from db import get_db
 
+# Only used when the server is standalone and cannot open change streams.
 POLL_INTERVAL_SECONDS = 5.0
 
+RECONNECT_DELAY_SECONDS = 0.1
+PENDING_BATCH_LIMIT = 5
+# The worker only needs to know which file to analyze.
+PENDING_PROJECTION = {"_id": 1, "audio_filename": 1}
+# Threads decoding the recordings of one batch concurrently.
+DECODE_WORKERS = 2
+
+# Server error code for "$changeStream is only supported on replica sets".
+CHANGE_STREAMS_UNSUPPORTED = 40573
+PENDING_INSERTS_PIPELINE = [
+    {"$match": {"operationType": "insert", "fullDocument.status": "pending"}},
+    # The event only wakes the worker up; the batch is re-read with find().
+    {"$project": {"_id": 1}},
+]
+
+# Every recording is converted to 16 kHz mono before analysis.
+SAMPLE_RATE = 16000
+MODEL = "tiny"
+# Stored on every analysis and part of the pitch cache key, so switching
+# models never serves pitches estimated by the old one.
+ANALYSIS_METHOD = f"torchcrepe-{MODEL}"
+# Number of 1024-sample CREPE frames per forward pass (~20 s of audio).
+BATCH_SIZE = 2048
+DEVICE = torch.device("cpu")
+# Frames below -50 dBFS RMS are treated as silence and skipped by the model.
+SILENCE_RMS = 10 ** (-50 / 20)
+# Run the CNN in bfloat16. Off by default: it only beats float32 on CPUs with
+# native bf16 (AVX512-BF16 / AMX), is slower elsewhere, and moves the decoded
+# pitch by up to one 20-cent CREPE bin. Dynamic int8 quantization only covers
+# the final Linear layer, so it does not help here.
+USE_BF16 = os.getenv("CREPE_BF16", "0") == "1"
+# Compile CREPE with Inductor at startup. Off by default: it needs a C
+# compiler in the image and adds tens of seconds before the first recording,
+# in exchange for roughly a third off each forward pass on CPU.
+USE_COMPILE = os.getenv("CREPE_COMPILE", "0") == "1"
+
+# An analysis dict, or the exception that prevented one.
+Outcome = Union[dict, Exception]
+
+_DECODE_POOL = ThreadPoolExecutor(max_workers=DECODE_WORKERS)
+
+# torch may default to a single intra-op thread inside containers. Leave one
+# core for the decode pool's ffmpeg processes so the two do not thrash, and
+# keep inter-op threads low since the CREPE graph is a simple chain.
+torch.set_num_threads(max(1, (os.cpu_count() or 1) - 1))
+torch.set_num_interop_threads(2)
+
+NOTE_NAMES = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
+_NOTE_NAMES_ARRAY = np.array(NOTE_NAMES)
+# 12 / ln(2): semitones per unit of natural log frequency.
+_SEMITONES_PER_NEPER = 12 / math.log(2)
+
+# Bytes read at a time when hashing recordings for the pitch cache.
+HASH_CHUNK_BYTES = 1 << 20
+
+# Frames decoded per soundfile read when mixing down to mono.
+READ_BLOCK_FRAMES = 65536
+# Each decode thread reads every file's blocks into the same scratch array.
+_READ_SCRATCH = threading.local()
+
+# Containers soundfile reads directly, e.g. WAV, FLAC, OGG and MP3.
+_SNDFILE_FORMATS = frozenset(sf.available_formats())
+
+
+def _block_buffer(channels: int) -> np.ndarray:
+    """Return this thread's (READ_BLOCK_FRAMES, channels) read buffer."""
+    buffers = getattr(_READ_SCRATCH, "buffers", None)
+    if buffers is None:
+        buffers = _READ_SCRATCH.buffers = {}
+    if channels not in buffers:
+        buffers[channels] = np.empty((READ_BLOCK_FRAMES, channels), dtype=np.float32)
+    return buffers[channels]
+
 
 def get_audio_dir() -> Path:
     """Return the directory where the web app saves recordings."""
@@ -33,27 +114,39 @@ def get_audio_dir() -> Path:
     return path
 
 
-def convert_to_wav(input_path: Path, output_dir: Path) -> Path:
-    """Use ffmpeg to convert any audio file to mono 16 kHz WAV."""
-    output_dir.mkdir(parents=True, exist_ok=True)
-    wav_path = output_dir / f"{input_path.stem}.wav"
+def _sndfile_can_read(path: Path) -> bool:
+    """Return True if libsndfile can decode the file without ffmpeg."""
+    return path.suffix[1:].upper() in _SNDFILE_FORMATS
+
+
+def decode_with_ffmpeg(input_path: Path) -> np.ndarray:
+    """Use ffmpeg to decode any audio file to mono 16 kHz float32 samples.
 
+    The samples are streamed back over a pipe as raw f32le, so nothing is
+    written to disk and libsndfile is not involved.
+    """
     cmd = [
         "ffmpeg",
-        "-y",  # overwrite
         "-loglevel",
         "error",  # only show errors
         "-i",
         str(input_path),
+        "-f",
+        "f32le",  # raw little-endian float32
         "-ac",
         "1",  # mono
         "-ar",
-        "16000",  # 16 kHz
-        str(wav_path),
+        str(SAMPLE_RATE),
+        "pipe:1",
     ]
-    # If ffmpeg fails, this will raise CalledProcessError so we see it.
-    subprocess.run(cmd, check=True)
-    return wav_path
+    try:
+        proc = subprocess.run(cmd, check=True, capture_output=True)
+    except subprocess.CalledProcessError as exc:
+        # capture_output keeps ffmpeg's stderr out of the log, so carry it here.
+        stderr = exc.stderr.decode(errors="replace").strip()
+        raise RuntimeError(f"ffmpeg failed on {input_path}: {stderr}") from exc
+    # frombuffer over bytes is read-only; torch.from_numpy needs it writable.
+    return np.frombuffer(proc.stdout, dtype="<f4").copy()
 
 
 def hz_to_note(pitch_hz: float) -> str:
@@ -61,71 +154,249 @@ def hz_to_note(pitch_hz: float) -> str:
     if pitch_hz <= 0:
         return "N/A"
 
-    midi = 69 + 12 * math.log2(pitch_hz / 440.0)
-    midi_rounded = int(round(midi))
-
-    note_names = [
-        "C",
-        "C#",
-        "D",
-        "D#",
-        "E",
-        "F",
-        "F#",
-        "G",
-        "G#",
-        "A",
-        "A#",
-        "B",
-    ]
-    note_index = midi_rounded % 12
-    octave = midi_rounded // 12 - 1
+    midi = round(69.0 + _SEMITONES_PER_NEPER * math.log(pitch_hz * (1 / 440.0)))
+    return f"{NOTE_NAMES[midi % 12]}{midi // 12 - 1}"
 
-    return f"{note_names[note_index]}{octave}"
 
+def hz_to_midi(pitch_hz: np.ndarray) -> np.ndarray:
+    """Round an array of frequencies in Hz to the nearest MIDI note numbers."""
+    ratio = np.maximum(pitch_hz, 1e-9) / 440.0
+    return np.rint(69 + 12 * np.log2(ratio)).astype(np.int32)
 
-def estimate_pitch(
-    waveform: torch.Tensor, sample_rate: int
-) -> Optional[Tuple[float, float]]:
-    """Estimate a single pitch (Hz) and confidence using torchcrepe."""
+
+def hz_to_notes(pitch_hz: np.ndarray) -> np.ndarray:
+    """Vectorized hz_to_note: convert an array of frequencies to note names."""
+    pitch_hz = np.asarray(pitch_hz, dtype=np.float64)
+    midi = hz_to_midi(pitch_hz)
+    notes = np.char.add(_NOTE_NAMES_ARRAY[midi % 12], (midi // 12 - 1).astype(str))
+    return np.where(pitch_hz > 0, notes, "N/A")
+
+
+def _to_mono(waveform: torch.Tensor) -> torch.Tensor:
+    """Return a (1, samples) mono view of a 1-D or (channels, samples) tensor."""
     if waveform.dim() == 2 and waveform.size(0) > 1:
         waveform = waveform.mean(dim=0, keepdim=True)
     if waveform.dim() == 1:
         waveform = waveform.unsqueeze(0)
+    return waveform
 
-    hop_length = sample_rate // 100
 
-    device = torch.device("cpu")
-    waveform = waveform.to(device)
+def _summarize(
+    pitch: torch.Tensor, periodicity: torch.Tensor
+) -> Optional[Tuple[float, float]]:
+    """Reduce per-frame pitch/periodicity to a single (pitch_hz, confidence)."""
+    # The median filter's reflect padding needs at least two frames; a clip
+    # under one hop (~10 ms) has one, and must not fail the rest of its batch.
+    if pitch.size(-1) < 2:
+        return None
+
+    pitch = torchcrepe.filter.median(pitch, 3)
+    periodicity = torchcrepe.filter.median(periodicity, 3)
+
+    # One device-to-host copy; the rest of the reduction runs in NumPy.
+    pitch, periodicity = torch.stack([pitch, periodicity]).cpu().numpy()
+
+    voiced = pitch[periodicity >= 0.1]
+    if voiced.size == 0:
+        return None
 
-    with torch.no_grad():
-        pitch, periodicity = torchcrepe.predict(
-            waveform,
-            sample_rate,
-            hop_length,
+    # Average only the frames of the most common note: a plain mean lands
+    # between notes whenever the voice slides or wobbles.
+    midi = hz_to_midi(voiced)
+    dominant = np.bincount(midi).argmax()
+    pitch_hz = float(voiced[midi == dominant].mean())
+    confidence = float(periodicity.mean())
+    return pitch_hz, confidence
+
+
+def _active_frames(audio: torch.Tensor, hop_length: int) -> Iterator[torch.Tensor]:
+    """Masks of the CREPE frames of a (1, samples) clip that are not silent.
+
+    Frames are cut exactly like torchcrepe.preprocess does with pad=True and
+    yielded in BATCH_SIZE chunks, so each mask lines up with the chunk of
+    frames preprocess(..., batch_size=BATCH_SIZE) yields alongside it.
+    """
+    half_window = torchcrepe.WINDOW_SIZE // 2
+    padded = torch.nn.functional.pad(audio, (half_window, half_window))
+    # unfold is a view; only one chunk of windows is squared at a time.
+    windows = padded.unfold(-1, torchcrepe.WINDOW_SIZE, hop_length)[0]
+    for chunk in windows.split(BATCH_SIZE):
+        yield chunk.pow(2).mean(dim=-1).sqrt() > SILENCE_RMS
+
+
+def _frame_chunks(
+    audio: torch.Tensor, sample_rate: int, hop_length: int
+) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+    """Yield (normalized frames, non-silent mask) per BATCH_SIZE frames of a clip."""
+    return zip(
+        torchcrepe.preprocess(
+            audio, sample_rate, hop_length, BATCH_SIZE, device=audio.device
+        ),
+        _active_frames(audio, hop_length),
+    )
+
+
+def _infer(frames: torch.Tensor, device: torch.device) -> torch.Tensor:
+    """Run CREPE over normalized frames in BATCH_SIZE chunks."""
+    if frames.size(0) == 0:
+        return frames.new_empty((0, torchcrepe.PITCH_BINS))
+
+    with torch.autocast(device.type, dtype=torch.bfloat16, enabled=USE_BF16):
+        probabilities = torch.cat(
+            [
+                torchcrepe.infer(batch, MODEL, device)
+                for batch in frames.split(BATCH_SIZE)
+            ]
+        )
+    # The decoders work in float32.
+    return probabilities.float()
+
+
+def _decode(
+    active: torch.Tensor, probabilities: torch.Tensor
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Decode one clip's probabilities back onto its full frame grid.
+
+    Skipped (silent) frames come back as NaN pitch with zero periodicity.
+    """
+    # Allocated next to the probabilities so the only device-to-host copy
+    # left is the one in _summarize.
+    pitch = probabilities.new_full((1, active.numel()), float("nan"))
+    periodicity = probabilities.new_zeros((1, active.numel()))
+    if probabilities.size(0):
+        pitch[:, active], periodicity[:, active] = torchcrepe.postprocess(
+            probabilities.T.unsqueeze(0),
             fmin=50.0,
             fmax=800.0,
-            model="tiny",
-            batch_size=1024,
-            device=device,
             return_periodicity=True,
         )
+    return pitch, periodicity
 
-        pitch = torchcrepe.filter.median(pitch, 3)
-        periodicity = torchcrepe.filter.median(periodicity, 3)
-        pitch[periodicity < 0.1] = float("nan")
 
-    valid = pitch[~torch.isnan(pitch)]
-    if valid.numel() == 0:
-        return None
+def estimate_pitches(
+    waveforms: List[torch.Tensor], sample_rate: int
+) -> List[Optional[Tuple[float, float]]]:
+    """Estimate pitch and confidence for several clips in one CREPE pass.
 
-    pitch_hz = float(valid.mean().item())
-    confidence = float(periodicity.mean().item())
-    return pitch_hz, confidence
+    Every clip is framed on its own, in BATCH_SIZE chunks, and the frames of
+    all clips are queued and run through the network together, up to
+    BATCH_SIZE frames per call. The resulting probabilities are split back
+    per clip before decoding. This pays the model's per-call overhead once per
+    batch of recordings instead of once per recording, while only about one
+    batch of frames (each 1024 samples) is held in memory at a time.
 
+    Frames quieter than SILENCE_RMS never reach the network; they count as
+    unvoiced (NaN pitch, zero periodicity) at their original positions.
+    """
+    hop_length = sample_rate // 100
 
-def analyze_recording(recording: dict, audio_dir: Path) -> dict:
-    """Load, convert, and analyze one recording document from MongoDB."""
+    device = DEVICE
+
+    with torch.inference_mode():
+        active = []
+        probabilities = []
+        pending = []
+        pending_frames = 0
+        for waveform in waveforms:
+            audio = _to_mono(waveform).to(device)
+            clip_active = []
+            for chunk, chunk_active in _frame_chunks(audio, sample_rate, hop_length):
+                if pending_frames + chunk.size(0) > BATCH_SIZE:
+                    probabilities.append(_infer(torch.cat(pending), device))
+                    pending, pending_frames = [], 0
+                pending.append(chunk[chunk_active])
+                pending_frames += chunk.size(0)
+                clip_active.append(chunk_active)
+            active.append(torch.cat(clip_active))
+        if pending:
+            probabilities.append(_infer(torch.cat(pending), device))
+        probabilities = torch.cat(probabilities)
+
+        # One host sync for all clips' frame counts instead of one per clip.
+        active_counts = torch.stack([mask.sum() for mask in active]).tolist()
+
+        results = [
+            _summarize(*_decode(clip_active, clip_probs))
+            for clip_active, clip_probs in zip(
+                active, probabilities.split(active_counts)
+            )
+        ]
+
+    return results
+
+
+def estimate_pitch(
+    waveform: torch.Tensor, sample_rate: int
+) -> Optional[Tuple[float, float]]:
+    """Estimate a single pitch (Hz) and confidence using torchcrepe."""
+    return estimate_pitches([waveform], sample_rate)[0]
+
+
+def warm_up_model() -> None:
+    """Load the CREPE weights once and run a dummy clip through the pipeline.
+
+    The first call in a process pays for reading the checkpoint and for
+    one-time setup in the decoder, so do it before any recording is waiting.
+    """
+    torchcrepe.load.model(DEVICE, MODEL)
+    # A tone rather than silence, which would never reach the network.
+    seconds = torch.arange(SAMPLE_RATE) / SAMPLE_RATE
+    tone = torch.sin(2 * math.pi * 440.0 * seconds).unsqueeze(0)
+    if USE_COMPILE:
+        _compile_model(tone)
+    estimate_pitch(tone, SAMPLE_RATE)
+
+
+def _compile_model(tone: torch.Tensor) -> None:
+    """Swap in a torch.compile'd CREPE, staying eager if compilation fails.
+
+    Compilation is lazy, so the tone is run through here to pay for it at
+    startup. Shapes are left dynamic because the frame count per forward
+    pass changes with clip length and skipped silence.
+    """
+    eager = torchcrepe.infer.model
+    torchcrepe.infer.model = torch.compile(eager, dynamic=True)
+    try:
+        estimate_pitch(tone, SAMPLE_RATE)
+    except Exception as exc:  # pylint: disable=broad-except
+        print(f"[worker] torch.compile failed, running eager: {exc}")
+        torchcrepe.infer.model = eager
+
+
+def read_mono(path: Path) -> Tuple[np.ndarray, int]:
+    """Read an audio file as mono float32 samples and its sample rate.
+
+    Channels are averaged block by block straight into one preallocated
+    buffer, so multi-channel audio is never held interleaved or transposed.
+    Blocks are read into a per-thread scratch array that is reused across
+    files, rather than soundfile allocating and copying one per block.
+    """
+    with sf.SoundFile(str(path)) as audio:
+        samples = np.empty(audio.frames, dtype=np.float32)
+        start = 0
+        for block in audio.blocks(out=_block_buffer(audio.channels)):
+            end = start + len(block)
+            block.mean(axis=1, out=samples[start:end])
+            start = end
+        return samples[:start], audio.samplerate
+
+
+def decode_audio(path: Path) -> Tuple[np.ndarray, int]:
+    """Decode a file to mono float32 samples, in-process when possible."""
+    if _sndfile_can_read(path):
+        # libsndfile decodes these in-process: no ffmpeg fork, no temp WAV.
+        try:
+            return read_mono(path)
+        except sf.LibsndfileError:
+            # A known container with a codec this libsndfile lacks (e.g. Opus
+            # in .ogg on older builds); ffmpeg can still decode it.
+            pass
+    # Browser recordings (WebM/Opus) still need ffmpeg to decode.
+    return decode_with_ffmpeg(path), SAMPLE_RATE
+
+
+def load_waveform(recording: dict, audio_dir: Path) -> torch.Tensor:
+    """Decode one recording document's audio file to a 16 kHz waveform."""
     filename = recording.get("audio_filename")
     if not filename:
         raise RuntimeError("Recording has no audio_filename")
@@ -134,21 +405,17 @@ def analyze_recording(recording: dict, audio_dir: Path) -> dict:
     if not src_path.exists():
         raise FileNotFoundError(f"Audio file not found: {src_path}")
 
-    # convert to WAV via ffmpeg
-    wav_dir = audio_dir / "wav_cache"
-    wav_path = convert_to_wav(src_path, wav_dir)
-
-    # load WAV file with soundfile
-    samples, sample_rate = sf.read(str(wav_path), dtype="float32")
-
-    if samples.ndim == 1:
-        waveform_np = samples[np.newaxis, :]
-    else:
-        waveform_np = samples.T
+    samples, sample_rate = decode_audio(src_path)
+    waveform = torch.from_numpy(samples).unsqueeze(0)
+    if sample_rate != SAMPLE_RATE:
+        waveform = torchaudio.functional.resample(
+            waveform, sample_rate, SAMPLE_RATE, lowpass_filter_width=16
+        )
+    return waveform
 
-    waveform = torch.from_numpy(waveform_np)
 
-    result = estimate_pitch(waveform, sample_rate)
+def build_analysis(result: Optional[Tuple[float, float]]) -> dict:
+    """Turn an estimate_pitch result into the analysis stored in MongoDB."""
     if result is None:
         raise RuntimeError("Could not estimate a stable pitch")
 
@@ -159,8 +426,285 @@ def analyze_recording(recording: dict, audio_dir: Path) -> dict:
         "pitch_hz": pitch_hz,
         "pitch_note": note,
         "confidence": confidence,
-        "method": "torchcrepe-tiny",
+        "method": ANALYSIS_METHOD,
+    }
+
+
+def analyze_recording(recording: dict, audio_dir: Path) -> dict:
+    """Load, convert, and analyze one recording document from MongoDB."""
+    waveform = load_waveform(recording, audio_dir)
+    return build_analysis(estimate_pitch(waveform, SAMPLE_RATE))
+
+
+def _done_update(rec_id, analysis: dict) -> UpdateOne:
+    """Build the write that stores a successful analysis on a recording."""
+    print(
+        f"[worker] Analyzed recording {rec_id} "
+        f"-> {analysis['pitch_note']} ({analysis['pitch_hz']:.1f} Hz)"
+    )
+    return UpdateOne(
+        {"_id": rec_id},
+        {
+            "$set": {
+                "analysis": analysis,
+                "status": "done",
+                "updated_at": datetime.utcnow(),
+                "error_message": None,
+            }
+        },
+    )
+
+
+def _error_update(rec_id, exc: Exception) -> UpdateOne:
+    """Build the write that stores an analysis failure on a recording."""
+    print(f"[worker] Could not estimate pitch for {rec_id}: {exc}")
+    return UpdateOne(
+        {"_id": rec_id},
+        {
+            "$set": {
+                "status": "error",
+                "error_message": str(exc),
+                "updated_at": datetime.utcnow(),
+            }
+        },
+    )
+
+
+def _outcome_update(rec_id, outcome: Outcome) -> UpdateOne:
+    """Build the write that stores an analysis outcome on a recording."""
+    if isinstance(outcome, Exception):
+        return _error_update(rec_id, outcome)
+    return _done_update(rec_id, outcome)
+
+
+def decode_batch(pending: List[dict], audio_dir: Path) -> List[Tuple[Any, Future]]:
+    """Start decoding a batch of recordings on the decode pool."""
+    # ffmpeg and soundfile release the GIL, so the clips decode side by side.
+    return [
+        (rec["_id"], _DECODE_POOL.submit(load_waveform, rec, audio_dir))
+        for rec in pending
+    ]
+
+
+def analyze_decoded(decoding: List[Tuple[Any, Future]]) -> Dict[Any, Outcome]:
+    """Wait for a batch's decodes and analyze the clips together.
+
+    Returns each recording's analysis, or the exception that stopped it,
+    keyed by the recording's _id.
+    """
+    outcomes: Dict[Any, Outcome] = {}
+    loaded = []
+    for rec_id, future in decoding:
+        try:
+            loaded.append((rec_id, future.result()))
+        except Exception as exc:  # pylint: disable=broad-except
+            outcomes[rec_id] = exc
+
+    if not loaded:
+        return outcomes
+
+    try:
+        results = estimate_pitches([waveform for _, waveform in loaded], SAMPLE_RATE)
+    except Exception as exc:  # pylint: disable=broad-except
+        outcomes.update((rec_id, exc) for rec_id, _ in loaded)
+        return outcomes
+
+    for (rec_id, _), result in zip(loaded, results):
+        try:
+            outcomes[rec_id] = build_analysis(result)
+        except RuntimeError as exc:
+            outcomes[rec_id] = exc
+
+    return outcomes
+
+
+def file_digest(path: Path) -> str:
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _recording_digest(recording: dict, audio_dir: Path) -> Optional[str]:
+    """Hash a recording's audio file, or return None if it cannot be read."""
+    filename = recording.get("audio_filename")
+    if not filename:
+        return None
+    try:
+        return file_digest(audio_dir / filename)
+    except OSError:
+        # load_waveform reports the problem when the recording is analyzed
+        return None
+
+
+def _cache_key(digest: str) -> str:
+    """pitch_cache _id for audio with this digest under the current method."""
+    return f"{ANALYSIS_METHOD}:{digest}"
+
+
+def load_cached_analyses(db, digests: List[str]) -> Dict[str, dict]:
+    """Return earlier analyses of identical audio, keyed by content digest."""
+    if not digests:
+        return {}
+    keys = {_cache_key(digest): digest for digest in digests}
+    cursor = db.pitch_cache.find({"_id": {"$in": list(keys)}})
+    return {keys[doc["_id"]]: doc["analysis"] for doc in cursor}
+
+
+def cache_analyses(db, analyses: Dict[str, dict]) -> None:
+    """Remember analyses by content digest so re-submitted audio is skipped.
+
+    Best effort: a failed write (e.g. two workers upserting the same key)
+    only costs a later cache miss, so it is logged and not raised.
+    """
+    if not analyses:
+        return
+    now = datetime.utcnow()
+    try:
+        db.pitch_cache.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": _cache_key(digest)},
+                    {"$set": {"analysis": analysis, "updated_at": now}},
+                    upsert=True,
+                )
+                for digest, analysis in analyses.items()
+            ],
+            ordered=False,
+        )
+    except PyMongoError as exc:
+        print(f"[worker] Could not cache analyses: {exc}")
+
+
+def save_updates(db, updates: List[UpdateOne]) -> None:
+    """Write all of a batch's results to MongoDB in one round-trip."""
+    if not updates:
+        return
+
+    try:
+        # Every update targets a different recording, so order does not matter.
+        db.recordings.bulk_write(updates, ordered=False)
+    except BulkWriteError as exc:
+        # One failed write does not stop the others in an unordered bulk.
+        for error in exc.details.get("writeErrors", []):
+            print(f"[worker] Could not save a recording: {error['errmsg']}")
+
+
+@dataclass
+class Batch:
+    """Recordings fetched together, with their cache hits and running decodes."""
+
+    pending: List[dict]
+    digests: Dict[Any, Optional[str]]
+    outcomes: Dict[Any, Outcome]
+    decoding: List[Tuple[Any, Future]]
+
+
+def start_batch(db, pending: List[dict], audio_dir: Path) -> Batch:
+    """Look a batch up in the pitch cache and start decoding the misses.
+
+    Audio that was analyzed before (same bytes, e.g. a retry or a duplicate
+    upload) is answered from the pitch_cache collection without inference.
+    """
+    digests = {rec["_id"]: _recording_digest(rec, audio_dir) for rec in pending}
+    cached = load_cached_analyses(db, [d for d in set(digests.values()) if d])
+
+    outcomes: Dict[Any, Outcome] = {
+        rec_id: cached[digest] for rec_id, digest in digests.items() if digest in cached
     }
+    misses = [rec for rec in pending if rec["_id"] not in outcomes]
+    return Batch(pending, digests, outcomes, decode_batch(misses, audio_dir))
+
+
+def finish_batch(db, batch: Batch) -> None:
+    """Analyze a started batch, then save and cache its results."""
+    analyzed = analyze_decoded(batch.decoding)
+
+    # Recordings first: the cache is only an optimization.
+    outcomes = {**batch.outcomes, **analyzed}
+    save_updates(
+        db,
+        [_outcome_update(rec["_id"], outcomes[rec["_id"]]) for rec in batch.pending],
+    )
+
+    cache_analyses(
+        db,
+        {
+            batch.digests[rec_id]: outcome
+            for rec_id, outcome in analyzed.items()
+            if batch.digests[rec_id] and not isinstance(outcome, Exception)
+        },
+    )
+
+
+def process_pending_recordings(db, pending: List[dict], audio_dir: Path) -> None:
+    """Analyze a batch of recordings and save the results."""
+    finish_batch(db, start_batch(db, pending, audio_dir))
+
+
+def ensure_indexes(db) -> None:
+    """Back the pending-recordings query with an index (no-op if it exists).
+
+    The index is partial: only pending recordings are stored in it, so it
+    stays as small as the backlog no matter how many analyses are done.
+    """
+    db.recordings.create_index(
+        [("status", 1), ("created_at", 1)],
+        name="pending_created_at_idx",
+        partialFilterExpression={"status": "pending"},
+    )
+
+
+def _start_next_batch(db, audio_dir: Path, exclude: List[Any]) -> Optional[Batch]:
+    """Fetch the oldest pending recordings not in exclude and start them."""
+    pending = list(
+        db.recordings.find(
+            {"status": "pending", "_id": {"$nin": exclude}}, PENDING_PROJECTION
+        )
+        .sort("created_at", 1)
+        .limit(PENDING_BATCH_LIMIT)
+    )
+    if not pending:
+        return None
+
+    print(f"[worker] Found {len(pending)} pending recording(s).")
+    return start_batch(db, pending, audio_dir)
+
+
+def drain_pending_recordings(db, audio_dir: Path) -> None:
+    """Analyze pending recordings batch by batch until none are left.
+
+    The next batch is fetched and starts decoding before the current one
+    goes through the model, so its database and file I/O overlap inference.
+    """
+    batch = _start_next_batch(db, audio_dir, exclude=[])
+    while batch is not None:
+        in_progress = [rec["_id"] for rec in batch.pending]
+        upcoming = _start_next_batch(db, audio_dir, exclude=in_progress)
+        finish_batch(db, batch)
+        batch = upcoming
+
+
+def watch_recordings(db, audio_dir: Path) -> None:
+    """Wake up on every newly inserted pending recording and analyze it."""
+    with db.recordings.watch(PENDING_INSERTS_PIPELINE) as stream:
+        # Pick up anything inserted before the stream was opened.
+        drain_pending_recordings(db, audio_dir)
+        for _change in stream:
+            drain_pending_recordings(db, audio_dir)
+
+
+def poll_recordings(db, audio_dir: Path) -> None:
+    """Fallback for servers without change streams: poll on a fixed interval."""
+    while True:
+        try:
+            drain_pending_recordings(db, audio_dir)
+        except PyMongoError as exc:
+            # Runs outside worker_loop's reconnect handler, so retry here.
+            print(f"[worker] Polling failed: {exc}; retrying.")
+        time.sleep(POLL_INTERVAL_SECONDS)
 
 
 def worker_loop() -> None:
@@ -168,50 +712,25 @@ def worker_loop() -> None:
     db = get_db()
     audio_dir = get_audio_dir()
 
+    print(f"[worker] Loading {MODEL} CREPE model on {DEVICE}.")
+    warm_up_model()
+
     print(f"[worker] Watching for recordings in: {audio_dir}")
 
     while True:
-        pending = list(db.recordings.find({"status": "pending"}).limit(5))
-        if not pending:
-            print("[worker] No pending recordings.")
-            time.sleep(POLL_INTERVAL_SECONDS)
-            continue
-
-        print(f"[worker] Found {len(pending)} pending recording(s).")
-
-        for rec in pending:
-            rec_id = rec["_id"]
-            try:
-                analysis = analyze_recording(rec, audio_dir)
-                db.recordings.update_one(
-                    {"_id": rec_id},
-                    {
-                        "$set": {
-                            "analysis": analysis,
-                            "status": "done",
-                            "updated_at": datetime.utcnow(),
-                            "error_message": None,
-                        }
-                    },
-                )
-                print(
-                    f"[worker] Updated recording {rec_id} "
-                    f"-> {analysis['pitch_note']} ({analysis['pitch_hz']:.1f} Hz)"
-                )
-            except Exception as exc:  # pylint: disable=broad-except
-                db.recordings.update_one(
-                    {"_id": rec_id},
-                    {
-                        "$set": {
-                            "status": "error",
-                            "error_message": str(exc),
-                            "updated_at": datetime.utcnow(),
-                        }
-                    },
-                )
-                print(f"[worker] Could not estimate pitch for {rec_id}: {exc}")
-
-        time.sleep(POLL_INTERVAL_SECONDS)
+        try:
+            ensure_indexes(db)
+            watch_recordings(db, audio_dir)
+        except OperationFailure as exc:
+            if exc.code != CHANGE_STREAMS_UNSUPPORTED:
+                print(f"[worker] Change stream failed: {exc}; reconnecting.")
+                time.sleep(RECONNECT_DELAY_SECONDS)
+                continue
+            print("[worker] Change streams need a replica set; polling instead.")
+            poll_recordings(db, audio_dir)
+        except PyMongoError as exc:
+            print(f"[worker] Change stream interrupted: {exc}; reconnecting.")
+            time.sleep(RECONNECT_DELAY_SECONDS)
 
 
 if __name__ == "__main__":
@@ -20,9 +20,17 @@ if str(ROOT) not in sys.path:
 import db  # pylint: disable=import-error, wrong-import-position
 
 
+@pytest.fixture(autouse=True)
+def clear_client_cache():
+    """Make every test build its own cached MongoClient."""
+    db._get_mongo_client.cache_clear()
+    yield
+    db._get_mongo_client.cache_clear()
+
+
 def test_get_mongo_client_raises_when_mongo_uri_missing(monkeypatch):
     """If MONGO_URI isn't set, _get_mongo_client should raise RuntimeError."""
-    monkeypatch.delenv("MONGO_URI", raising=False)
+    monkeypatch.setattr(db, "CFG", db.Config(mongo_uri=None, mongo_db_name=None))
 
     # Accessing the helper directly is intentional in this test.
     with pytest.raises(RuntimeError):
@@ -31,8 +39,10 @@ def test_get_mongo_client_raises_when_mongo_uri_missing(monkeypatch):
 
 def test_get_mongo_client_returns_client_when_env_present(monkeypatch):
     """When MONGO_URI is set, _get_mongo_client should return a MongoClient."""
-    # Make sure the env var exists with some dummy URI
-    monkeypatch.setenv("MONGO_URI", "mongodb://example:27017")
+    # Make sure the config has some dummy URI
+    monkeypatch.setattr(
+        db, "CFG", db.Config(mongo_uri="mongodb://example:27017", mongo_db_name=None)
+    )
 
     client = db._get_mongo_client()  # type: ignore[attr-defined]
 
@@ -40,6 +50,30 @@ def test_get_mongo_client_returns_client_when_env_present(monkeypatch):
     assert isinstance(client, MongoClient)
 
 
+def test_get_mongo_client_is_shared_between_calls(monkeypatch):
+    """Repeated calls should reuse one MongoClient and its connection pool."""
+    monkeypatch.setattr(
+        db, "CFG", db.Config(mongo_uri="mongodb://example:27017", mongo_db_name=None)
+    )
+
+    first = db._get_mongo_client()  # type: ignore[attr-defined]
+    second = db._get_mongo_client()  # type: ignore[attr-defined]
+
+    assert first is second
+
+
+def test_config_load_reads_environment(monkeypatch):
+    """Config.load should snapshot MONGO_URI and MONGO_DB_NAME."""
+    monkeypatch.setenv("MONGO_URI", "mongodb://example:27017")
+    monkeypatch.setenv("MONGO_DB_NAME", "pitchdb_test")
+
+    cfg = db.Config.load()
+
+    assert cfg == db.Config(
+        mongo_uri="mongodb://example:27017", mongo_db_name="pitchdb_test"
+    )
+
+
 def test_get_db_uses_mongo_db_name_env(monkeypatch):
     """get_db should index the MongoClient with the DB name from MONGO_DB_NAME."""
 
@@ -56,9 +90,12 @@ def test_get_db_uses_mongo_db_name_env(monkeypatch):
 
     fake_client = FakeClient()
 
-    # Ensure env vars exist
-    monkeypatch.setenv("MONGO_URI", "mongodb://example:27017")
-    monkeypatch.setenv("MONGO_DB_NAME", "pitchdb_test")
+    # Ensure the config has both settings
+    monkeypatch.setattr(
+        db,
+        "CFG",
+        db.Config(mongo_uri="mongodb://example:27017", mongo_db_name="pitchdb_test"),
+    )
 
     # Replace the real _get_mongo_client with our fake one
     monkeypatch.setattr(db, "_get_mongo_client", lambda: fake_client)
@@ -75,10 +112,11 @@ def test_get_db_raises_when_db_name_missing(monkeypatch):
     class DummyClient:
         """Tiny dummy client used only to avoid constructing a real MongoClient."""
 
-    # MONGO_URI must be set so _get_mongo_client would succeed, but
+    # MONGO_URI is configured so _get_mongo_client would succeed, but
     # we stub it out anyway so we don't create a real MongoClient.
-    monkeypatch.setenv("MONGO_URI", "mongodb://example:27017")
-    monkeypatch.delenv("MONGO_DB_NAME", raising=False)
+    monkeypatch.setattr(
+        db, "CFG", db.Config(mongo_uri="mongodb://example:27017", mongo_db_name=None)
+    )
 
     def fake_get_mongo_client():
         """Return a dummy client instead of a real MongoClient."""
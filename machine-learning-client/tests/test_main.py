@@ -1,11 +1,11 @@
 """Unit tests for main.py in the machine-learning client."""
 
 # pylint: disable=missing-function-docstring,too-few-public-methods
+# pylint: disable=redefined-outer-name  # pytest fixtures
 
 from pathlib import Path
 import sys
 
-import numpy as np
 import pytest
 
 # Make sure the parent directory (containing main.py) is on the path
@@ -32,6 +32,48 @@ except OSError as exc:  # soundfile/torch shared libs missing on some systems
         allow_module_level=True,
     )
 
+# Imported only once main has loaded, so a skipped module never pays for it.
+import numpy as np  # pylint: disable=wrong-import-position,wrong-import-order
+from pymongo.errors import AutoReconnect  # pylint: disable=wrong-import-position
+
+
+def test_warm_up_model_preloads_weights(monkeypatch):
+    loaded = []
+    clips = []
+
+    monkeypatch.setattr(
+        main.torchcrepe.load, "model", lambda device, capacity: loaded.append(capacity)
+    )
+    monkeypatch.setattr(
+        main, "estimate_pitch", lambda waveform, sample_rate: clips.append(waveform)
+    )
+
+    main.warm_up_model()
+
+    assert loaded == [main.MODEL]
+    assert len(clips) == 1
+
+
+def test_warm_up_model_falls_back_to_eager_when_compile_fails(monkeypatch):
+    eager = object()
+
+    def fake_load(device, capacity):  # pylint: disable=unused-argument
+        main.torchcrepe.infer.model = eager
+
+    def fake_estimate_pitch(waveform, sample_rate):  # pylint: disable=unused-argument
+        if main.torchcrepe.infer.model is not eager:
+            raise RuntimeError("no C compiler")
+
+    monkeypatch.setattr(main, "USE_COMPILE", True)
+    monkeypatch.setattr(main.torchcrepe.infer, "model", None, raising=False)
+    monkeypatch.setattr(main.torchcrepe.load, "model", fake_load)
+    monkeypatch.setattr(main.torch, "compile", lambda model, dynamic: ("compiled",))
+    monkeypatch.setattr(main, "estimate_pitch", fake_estimate_pitch)
+
+    main.warm_up_model()
+
+    assert main.torchcrepe.infer.model is eager
+
 
 def test_get_audio_dir_respects_env_and_creates_dir(tmp_path, monkeypatch):
     audio_root = tmp_path / "recordings"
@@ -51,76 +93,200 @@ def test_hz_to_note_basic_and_guard():
     assert main.hz_to_note(-10.0) == "N/A"
 
 
-def test_convert_to_wav_invokes_ffmpeg(tmp_path, monkeypatch):
+def test_hz_to_notes_matches_hz_to_note():
+    freqs = np.array([440.0, 261.63, 0.0, -10.0, 82.41, 1046.5])
+
+    notes = main.hz_to_notes(freqs)
+
+    assert list(notes) == [main.hz_to_note(f) for f in freqs]
+
+
+def test_decode_with_ffmpeg_reads_samples_from_pipe(tmp_path, monkeypatch):
     input_path = tmp_path / "input.webm"
     input_path.write_bytes(b"fake webm")
 
-    out_dir = tmp_path / "out"
-
     calls: dict[str, object] = {}
 
-    def fake_run(cmd, check):  # pylint: disable=unused-argument
+    def fake_run(cmd, check, capture_output):
         calls["cmd"] = cmd
         calls["check"] = check
-        out = Path(cmd[-1])
-        out.parent.mkdir(parents=True, exist_ok=True)
-        out.write_bytes(b"fake wav")
+        calls["capture_output"] = capture_output
+        return main.subprocess.CompletedProcess(
+            cmd, 0, stdout=np.array([0.25, -0.5], dtype="<f4").tobytes()
+        )
 
     monkeypatch.setattr(main.subprocess, "run", fake_run)
 
-    wav_path = main.convert_to_wav(input_path, out_dir)
-
-    assert wav_path.parent == out_dir
-    assert wav_path.suffix == ".wav"
-    assert wav_path.exists()
+    samples = main.decode_with_ffmpeg(input_path)
 
+    assert samples.tolist() == [0.25, -0.5]
+    assert samples.flags.writeable
     assert calls["cmd"][0] == "ffmpeg"
+    assert calls["cmd"][-1] == "pipe:1"
     assert calls["check"] is True
+    assert calls["capture_output"] is True
+    assert list(tmp_path.iterdir()) == [input_path]
+
+
+def test_decode_with_ffmpeg_reports_ffmpeg_stderr(tmp_path, monkeypatch):
+    input_path = tmp_path / "broken.webm"
+    input_path.write_bytes(b"not audio")
 
+    def fake_run(cmd, check, capture_output):  # pylint: disable=unused-argument
+        raise main.subprocess.CalledProcessError(
+            1, cmd, output=b"", stderr=b"Invalid data found when processing input\n"
+        )
 
-def test_estimate_pitch_uses_torchcrepe(monkeypatch):
+    monkeypatch.setattr(main.subprocess, "run", fake_run)
+
+    with pytest.raises(RuntimeError, match="Invalid data found"):
+        main.decode_with_ffmpeg(input_path)
+
+
+@pytest.fixture
+def fake_crepe(monkeypatch):
+    """Return a function that swaps CREPE's network and decoder for fakes.
+
+    pitch and periodicity are either constants or functions of the frame
+    count returning a (1, frames) tensor. The returned dict lists the frame
+    count of every infer and postprocess call.
+    """
     torch_mod = main.torch
+    calls = {"infer": [], "postprocess": []}
+
+    def track(value, num_frames):
+        if callable(value):
+            return value(num_frames)
+        return torch_mod.full((1, num_frames), float(value))
+
+    def install(pitch=220.0, periodicity=0.9):
+        def fake_infer(frames, model, device):  # pylint: disable=unused-argument
+            calls["infer"].append(frames.size(0))
+            return torch_mod.zeros(frames.size(0), 360)
 
-    waveform = torch_mod.zeros(1, 16000)
-    sample_rate = 16000
+        def fake_postprocess(
+            probabilities, **kwargs
+        ):  # pylint: disable=unused-argument
+            num_frames = probabilities.size(2)
+            calls["postprocess"].append(num_frames)
+            return track(pitch, num_frames), track(periodicity, num_frames)
 
-    def fake_predict(*args, **kwargs):  # pylint: disable=unused-argument
-        pitch = torch_mod.tensor([[220.0, 220.0]])
-        periodicity = torch_mod.tensor([[0.9, 0.8]])
-        return pitch, periodicity
+        monkeypatch.setattr(main.torchcrepe, "infer", fake_infer)
+        monkeypatch.setattr(main.torchcrepe, "postprocess", fake_postprocess)
+        return calls
 
-    def fake_median(tensor, win):  # pylint: disable=unused-argument
-        return tensor
+    return install
 
-    monkeypatch.setattr(main.torchcrepe, "predict", fake_predict)
-    monkeypatch.setattr(main.torchcrepe.filter, "median", fake_median)
 
-    pitch_hz, confidence = main.estimate_pitch(waveform, sample_rate)
+def _pitch_from_frame_count(num_frames):
+    """Fake per-clip pitch that tells clips of different lengths apart."""
+    return main.torch.full((1, num_frames), 100.0 + num_frames)
+
+
+def test_estimate_pitch_uses_torchcrepe(fake_crepe):
+    fake_crepe(pitch=220.0)
+
+    pitch_hz, confidence = main.estimate_pitch(main.torch.full((1, 16000), 0.1), 16000)
 
     assert pitch_hz == pytest.approx(220.0)
     assert 0.0 <= confidence <= 1.0
 
 
-def test_estimate_pitch_returns_none_when_no_valid(monkeypatch):
+def test_estimate_pitch_returns_none_when_no_valid(fake_crepe):
+    fake_crepe(pitch=200.0, periodicity=0.0)  # below threshold
+
+    result = main.estimate_pitch(main.torch.full((1, 16000), 0.1), 16000)
+
+    assert result is None
+
+
+def test_estimate_pitch_reports_dominant_note(fake_crepe):
+    def mostly_a3(num_frames):
+        # Mostly A3 with a shorter excursion up to A4
+        pitch = main.torch.full((1, num_frames), 220.0)
+        pitch[:, -40:] = 440.0
+        return pitch
+
+    fake_crepe(pitch=mostly_a3)
+
+    pitch_hz, _ = main.estimate_pitch(main.torch.full((1, 16000), 0.1), 16000)
+
+    assert pitch_hz == pytest.approx(220.0)
+
+
+def test_estimate_pitches_runs_one_forward_pass_and_splits_per_clip(fake_crepe):
     torch_mod = main.torch
 
-    waveform = torch_mod.zeros(1, 16000)
-    sample_rate = 16000
+    # 16000 samples -> 101 frames, 8000 samples -> 51 frames at a 160 hop
+    waveforms = [torch_mod.full((1, 16000), 0.1), torch_mod.full((1, 8000), 0.1)]
+    calls = fake_crepe(pitch=_pitch_from_frame_count)
 
-    def fake_predict(*args, **kwargs):  # pylint: disable=unused-argument
-        pitch = torch_mod.full((1, 3), 200.0)
-        periodicity = torch_mod.zeros((1, 3))  # all below threshold
-        return pitch, periodicity
+    results = main.estimate_pitches(waveforms, 16000)
 
-    def fake_median(tensor, win):  # pylint: disable=unused-argument
-        return tensor
+    assert calls["infer"] == [152]
+    assert [pitch_hz for pitch_hz, _ in results] == [
+        pytest.approx(201.0),
+        pytest.approx(151.0),
+    ]
 
-    monkeypatch.setattr(main.torchcrepe, "predict", fake_predict)
-    monkeypatch.setattr(main.torchcrepe.filter, "median", fake_median)
 
-    result = main.estimate_pitch(waveform, sample_rate)
+def test_estimate_pitches_frames_and_infers_in_batch_size_chunks(
+    fake_crepe, monkeypatch
+):
+    torch_mod = main.torch
 
-    assert result is None
+    # 101 + 51 frames, cut into chunks of at most 40 and never more per call
+    waveforms = [torch_mod.full((1, 16000), 0.1), torch_mod.full((1, 8000), 0.1)]
+    monkeypatch.setattr(main, "BATCH_SIZE", 40)
+    calls = fake_crepe(pitch=_pitch_from_frame_count)
+
+    results = main.estimate_pitches(waveforms, 16000)
+
+    assert calls["infer"] == [40, 40, 21, 40, 11]
+    assert [pitch_hz for pitch_hz, _ in results] == [
+        pytest.approx(201.0),
+        pytest.approx(151.0),
+    ]
+
+
+def test_estimate_pitches_skips_silent_frames(fake_crepe):
+    # First half silent, second half loud: only frames touching the loud half
+    # reach the network and their pitch lands back at the end of the clip.
+    waveform = main.torch.zeros(1, 16000)
+    waveform[:, 8000:] = 0.1
+    calls = fake_crepe(pitch=220.0)
+
+    pitch_hz, _ = main.estimate_pitch(waveform, 16000)
+
+    assert 0 < calls["infer"][0] < 101
+    assert calls["postprocess"] == calls["infer"]
+    assert pitch_hz == pytest.approx(220.0)
+
+
+def test_analyze_decoded_fails_only_the_too_short_clip(fake_crepe):
+    # A 5 ms clip is a single frame, too short for the median filter; the
+    # 1 s clip decoded next to it must still be analyzed.
+    fake_crepe(pitch=440.0)
+    decoding = []
+    for rec_id, samples in [("long", 16000), ("short", 80)]:
+        future = main.Future()
+        future.set_result(main.torch.full((1, samples), 0.1))
+        decoding.append((rec_id, future))
+
+    outcomes = main.analyze_decoded(decoding)
+
+    assert outcomes["long"]["pitch_note"] == "A4"
+    assert isinstance(outcomes["short"], RuntimeError)
+    assert "stable pitch" in str(outcomes["short"])
+
+
+def test_estimate_pitches_silent_clip_skips_model(monkeypatch):
+    def fail_infer(*args, **kwargs):
+        raise AssertionError("silence should not be inferred")
+
+    monkeypatch.setattr(main.torchcrepe, "infer", fail_infer)
+
+    assert main.estimate_pitches([main.torch.zeros(1, 16000)], 16000) == [None]
 
 
 def test_analyze_recording_happy_path(tmp_path, monkeypatch):
@@ -129,24 +295,11 @@ def test_analyze_recording_happy_path(tmp_path, monkeypatch):
     src_file = audio_dir / recording["audio_filename"]
     src_file.write_bytes(b"fake data")
 
-    def fake_convert_to_wav(input_path, output_dir):
+    def fake_decode_with_ffmpeg(input_path):
         assert input_path == src_file
-        output_dir.mkdir(parents=True, exist_ok=True)
-        wav_path = output_dir / "clip.wav"
-        wav_path.write_bytes(b"fake wav")
-        return wav_path
-
-    monkeypatch.setattr(main, "convert_to_wav", fake_convert_to_wav)
-
-    class FakeSF:
-        "Fake SF"
-
-        @staticmethod
-        def read(path, dtype="float32"):  # pylint: disable=unused-argument
-            samples = np.ones(16000, dtype=np.float32)
-            return samples, 16000
+        return np.ones(16000, dtype=np.float32)
 
-    monkeypatch.setattr(main, "sf", FakeSF)
+    monkeypatch.setattr(main, "decode_with_ffmpeg", fake_decode_with_ffmpeg)
 
     def fake_estimate_pitch(waveform, sample_rate):  # pylint: disable=unused-argument
         return 440.0, 0.75
@@ -161,6 +314,67 @@ def test_analyze_recording_happy_path(tmp_path, monkeypatch):
     assert result["method"] == "torchcrepe-tiny"
 
 
+def test_load_waveform_decodes_wav_in_process(tmp_path, monkeypatch):
+    recording = {"audio_filename": "clip.wav"}
+    stereo = np.zeros((4000, 2), dtype=np.float32)
+    main.sf.write(str(tmp_path / "clip.wav"), stereo, 8000)
+
+    def fake_decode_with_ffmpeg(input_path):
+        raise AssertionError("WAV files should not go through ffmpeg")
+
+    monkeypatch.setattr(main, "decode_with_ffmpeg", fake_decode_with_ffmpeg)
+
+    waveform = main.load_waveform(recording, tmp_path)
+
+    # mixed down to mono and resampled from 8 kHz to 16 kHz
+    assert tuple(waveform.shape) == (1, 8000)
+
+
+def test_load_waveform_falls_back_to_ffmpeg_when_libsndfile_fails(
+    tmp_path, monkeypatch
+):
+    recording = {"audio_filename": "clip.ogg"}
+    (tmp_path / "clip.ogg").write_bytes(b"OggS but not a codec libsndfile knows")
+    decoded = []
+
+    def fake_decode_with_ffmpeg(input_path):
+        decoded.append(input_path)
+        return np.zeros(16000, dtype=np.float32)
+
+    monkeypatch.setattr(main, "decode_with_ffmpeg", fake_decode_with_ffmpeg)
+
+    waveform = main.load_waveform(recording, tmp_path)
+
+    assert decoded == [tmp_path / "clip.ogg"]
+    assert tuple(waveform.shape) == (1, 16000)
+
+
+def test_read_mono_averages_channels(tmp_path):
+    path = tmp_path / "stereo.wav"
+    stereo = np.stack([np.full(100_000, 0.5), np.zeros(100_000)], axis=1)
+    main.sf.write(str(path), stereo.astype(np.float32), 16000)
+
+    samples, sample_rate = main.read_mono(path)
+
+    assert sample_rate == 16000
+    assert samples.shape == (100_000,)
+    assert np.allclose(samples, 0.25)
+
+
+def test_read_mono_reuses_block_buffer_across_files(tmp_path):
+    first, second = tmp_path / "first.wav", tmp_path / "second.wav"
+    main.sf.write(str(first), np.full((100_000, 2), 0.5, dtype=np.float32), 16000)
+    main.sf.write(str(second), np.full((70_000, 2), -0.5, dtype=np.float32), 16000)
+
+    first_samples, _ = main.read_mono(first)
+    buffer = main._block_buffer(2)  # pylint: disable=protected-access
+    second_samples, _ = main.read_mono(second)
+
+    assert main._block_buffer(2) is buffer  # pylint: disable=protected-access
+    assert np.allclose(first_samples, 0.5)
+    assert np.allclose(second_samples, -0.5)
+
+
 def test_analyze_recording_missing_filename_raises(tmp_path):
     with pytest.raises(RuntimeError):
         main.analyze_recording({}, tmp_path)
@@ -176,25 +390,111 @@ def test_analyze_recording_missing_file_raises(tmp_path):
 
 
 class FakeCursor(list):
-    """Mimic a MongoDB cursor with .limit()."""
+    """Mimic a MongoDB cursor with .sort() and .limit()."""
+
+    def sort(self, key, direction):  # pylint: disable=unused-argument
+        # Test docs are inserted oldest first already.
+        return self
 
     def limit(self, n):
         return FakeCursor(self[:n])
 
 
+class FakeChangeStream:
+    """Mimic a MongoDB change stream used as a context manager."""
+
+    def __init__(self, changes):
+        self._changes = changes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __iter__(self):
+        return iter(self._changes)
+
+
+def _matches(doc, query):
+    for key, value in query.items():
+        if isinstance(value, dict):
+            if doc.get(key) in value["$nin"]:
+                return False
+        elif doc.get(key) != value:
+            return False
+    return True
+
+
+class FakeUpdateOne:
+    """Stand-in for pymongo's UpdateOne that keeps its arguments public."""
+
+    def __init__(self, filter_, update, upsert=False):
+        self.filter = filter_
+        self.update = update
+        self.upsert = upsert
+
+
+@pytest.fixture(autouse=True)
+def _readable_update_ones(monkeypatch):
+    """Have main build FakeUpdateOnes so the fake collections can read them."""
+    monkeypatch.setattr(main, "UpdateOne", FakeUpdateOne)
+
+
 class FakeRecordings:
     """Mimic a fake recording."""
 
     def __init__(self, docs):
         self.docs = docs
         self.updates = []
+        self.bulk_writes = 0
+        self.indexes = []
+
+    def find(self, query, projection):
+        return FakeCursor(
+            {k: v for k, v in doc.items() if k in projection}
+            for doc in self.docs
+            if _matches(doc, query)
+        )
+
+    def create_index(self, keys, **kwargs):
+        self.indexes.append((keys, kwargs))
+
+    def bulk_write(self, requests, ordered=True):
+        assert not ordered
+        self.bulk_writes += 1
+        for request in requests:
+            filter_, update = request.filter, request.update
+            self.updates.append((filter_, update))
+            for doc in self.docs:
+                if _matches(doc, filter_):
+                    doc.update(update["$set"])
+
+    def watch(self, pipeline):
+        _ = pipeline
+        # Like a standalone (non replica set) server.
+        raise main.OperationFailure(
+            "$changeStream is only supported on replica sets",
+            code=main.CHANGE_STREAMS_UNSUPPORTED,
+        )
+
+
+class FakePitchCache:
+    """Mimic the pitch_cache collection keyed by audio digest."""
+
+    def __init__(self):
+        self.analyses = {}
 
     def find(self, query):
-        _ = query
-        return FakeCursor(self.docs)
+        return [
+            {"_id": digest, "analysis": self.analyses[digest]}
+            for digest in query["_id"]["$in"]
+            if digest in self.analyses
+        ]
 
-    def update_one(self, filter_, update):
-        self.updates.append((filter_, update))
+    def bulk_write(self, requests, ordered=True):  # pylint: disable=unused-argument
+        for request in requests:
+            self.analyses[request.filter["_id"]] = request.update["$set"]["analysis"]
 
 
 class FakeDB:
@@ -202,26 +502,50 @@ class FakeDB:
 
     def __init__(self, docs):
         self.recordings = FakeRecordings(docs)
+        self.pitch_cache = FakePitchCache()
+
+
+@pytest.fixture
+def make_fake_db():
+    """Return a factory that builds a fresh FakeDB from a list of docs."""
+
+    def _make(docs):
+        return FakeDB(docs)
+
+    return _make
+
+
+@pytest.fixture
+def worker_db(make_fake_db, monkeypatch, tmp_path):
+    """Return a factory that points worker_loop at a new FakeDB.
+
+    The worker also gets tmp_path as its audio dir and skips model warm-up.
+    """
+    monkeypatch.setattr(main, "get_audio_dir", lambda: tmp_path)
+    monkeypatch.setattr(main, "warm_up_model", lambda: None)
+
+    def _make(docs):
+        fake_db = make_fake_db(docs)
+        monkeypatch.setattr(main, "get_db", lambda: fake_db)
+        return fake_db
 
+    return _make
 
-def test_worker_loop_processes_pending_recording(monkeypatch, tmp_path):
+
+def test_worker_loop_processes_pending_recording(monkeypatch, worker_db):
     docs = [
         {"_id": "abc123", "status": "pending", "audio_filename": "clip.webm"},
     ]
-    fake_db = FakeDB(docs)
+    fake_db = worker_db(docs)
 
-    monkeypatch.setattr(main, "get_db", lambda: fake_db)
-    monkeypatch.setattr(main, "get_audio_dir", lambda: tmp_path)
+    def fake_load(recording, audio_dir):  # pylint: disable=unused-argument
+        return main.torch.zeros(1, 16000)
 
-    def fake_analyze(recording, audio_dir):  # pylint: disable=unused-argument
-        return {
-            "pitch_hz": 440.0,
-            "pitch_note": "A4",
-            "confidence": 0.9,
-            "method": "test",
-        }
+    def fake_estimate(waveforms, sample_rate):  # pylint: disable=unused-argument
+        return [(440.0, 0.9) for _ in waveforms]
 
-    monkeypatch.setattr(main, "analyze_recording", fake_analyze)
+    monkeypatch.setattr(main, "load_waveform", fake_load)
+    monkeypatch.setattr(main, "estimate_pitches", fake_estimate)
 
     sleep_calls = []
 
@@ -241,22 +565,28 @@ def test_worker_loop_processes_pending_recording(monkeypatch, tmp_path):
     assert _filter == {"_id": "abc123"}
     assert update["$set"]["status"] == "done"
     assert update["$set"]["analysis"]["pitch_note"] == "A4"
+    assert fake_db.recordings.indexes == [
+        (
+            [("status", 1), ("created_at", 1)],
+            {
+                "name": "pending_created_at_idx",
+                "partialFilterExpression": {"status": "pending"},
+            },
+        )
+    ]
     assert sleep_calls, "worker_loop should call time.sleep()"
 
 
-def test_worker_loop_handles_analysis_error(monkeypatch, tmp_path):
+def test_worker_loop_handles_analysis_error(monkeypatch, worker_db):
     docs = [
         {"_id": "xyz789", "status": "pending", "audio_filename": "clip.webm"},
     ]
-    fake_db = FakeDB(docs)
+    fake_db = worker_db(docs)
 
-    monkeypatch.setattr(main, "get_db", lambda: fake_db)
-    monkeypatch.setattr(main, "get_audio_dir", lambda: tmp_path)
-
-    def fake_analyze(recording, audio_dir):  # pylint: disable=unused-argument
+    def fake_load(recording, audio_dir):  # pylint: disable=unused-argument
         raise RuntimeError("boom")
 
-    monkeypatch.setattr(main, "analyze_recording", fake_analyze)
+    monkeypatch.setattr(main, "load_waveform", fake_load)
 
     def fake_sleep(seconds):  # pylint: disable=unused-argument
         raise KeyboardInterrupt()
@@ -273,3 +603,233 @@ def test_worker_loop_handles_analysis_error(monkeypatch, tmp_path):
     assert _filter == {"_id": "xyz789"}
     assert update["$set"]["status"] == "error"
     assert "boom" in update["$set"]["error_message"]
+
+
+def test_worker_loop_reacts_to_change_stream_inserts(monkeypatch, worker_db):
+    fake_db = worker_db([])
+    inserted = {"_id": "new456", "status": "pending", "audio_filename": "clip.webm"}
+
+    def changes():
+        # The insert lands after the stream is open and the startup drain ran.
+        fake_db.recordings.docs.append(inserted)
+        yield {"_id": {"_data": "resume-token"}}
+        # Stop the otherwise endless stream
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(
+        fake_db.recordings, "watch", lambda pipeline: FakeChangeStream(changes())
+    )
+    monkeypatch.setattr(
+        main, "load_waveform", lambda recording, audio_dir: main.torch.zeros(1, 16000)
+    )
+    monkeypatch.setattr(
+        main,
+        "estimate_pitches",
+        lambda waveforms, sample_rate: [(440.0, 0.9) for _ in waveforms],
+    )
+
+    def fake_sleep(seconds):  # pylint: disable=unused-argument
+        raise AssertionError("worker_loop should not poll when streams work")
+
+    monkeypatch.setattr(main.time, "sleep", fake_sleep)
+
+    with pytest.raises(KeyboardInterrupt):
+        main.worker_loop()
+
+    assert [f for f, _ in fake_db.recordings.updates] == [{"_id": "new456"}]
+    assert inserted["status"] == "done"
+
+
+def test_worker_loop_keeps_polling_after_connection_errors(
+    monkeypatch, worker_db, capsys
+):
+    fake_db = worker_db([])
+    finds = []
+
+    def flaky_find(query, projection):  # pylint: disable=unused-argument
+        finds.append(query)
+        if len(finds) == 1:
+            raise AutoReconnect("connection reset")
+        return FakeCursor([])
+
+    monkeypatch.setattr(fake_db.recordings, "find", flaky_find)
+    sleep_calls = []
+
+    def fake_sleep(seconds):
+        sleep_calls.append(seconds)
+        if len(sleep_calls) == 2:
+            raise KeyboardInterrupt()
+
+    monkeypatch.setattr(main.time, "sleep", fake_sleep)
+
+    with pytest.raises(KeyboardInterrupt):
+        main.worker_loop()
+
+    assert len(finds) == 2
+    assert sleep_calls == [main.POLL_INTERVAL_SECONDS] * 2
+    assert "Polling failed: connection reset" in capsys.readouterr().out
+
+
+def test_process_pending_recordings_saves_batch_in_one_bulk_write(
+    tmp_path, monkeypatch, make_fake_db
+):
+    docs = [
+        {"_id": "ok1", "status": "pending", "audio_filename": "a.webm"},
+        {"_id": "bad", "status": "pending", "audio_filename": "b.webm"},
+        {"_id": "ok2", "status": "pending", "audio_filename": "c.webm"},
+    ]
+    fake_db = make_fake_db(docs)
+
+    def fake_load(recording, audio_dir):  # pylint: disable=unused-argument
+        if recording["_id"] == "bad":
+            raise FileNotFoundError("missing")
+        return main.torch.zeros(1, 16000)
+
+    monkeypatch.setattr(main, "load_waveform", fake_load)
+    monkeypatch.setattr(
+        main,
+        "estimate_pitches",
+        lambda waveforms, sample_rate: [(440.0, 0.9) for _ in waveforms],
+    )
+
+    main.process_pending_recordings(fake_db, docs, tmp_path)
+
+    assert fake_db.recordings.bulk_writes == 1
+    assert [doc["status"] for doc in docs] == ["done", "error", "done"]
+
+
+def test_save_updates_survives_bulk_write_errors(capsys):
+    class FailingRecordings:
+        """Collection whose bulk writes always report a write error."""
+
+        def bulk_write(self, requests, ordered=True):  # pylint: disable=unused-argument
+            raise main.BulkWriteError(
+                {"writeErrors": [{"index": 0, "code": 11000, "errmsg": "dup"}]}
+            )
+
+    class FailingDB:
+        """Database holding the failing collection."""
+
+        recordings = FailingRecordings()
+
+    update = main.UpdateOne({"_id": "x"}, {"$set": {"status": "done"}})
+
+    main.save_updates(FailingDB(), [update])
+
+    assert "Could not save a recording: dup" in capsys.readouterr().out
+
+
+def test_process_pending_recordings_caches_by_audio_content(
+    tmp_path, monkeypatch, make_fake_db
+):
+    (tmp_path / "first.webm").write_bytes(b"same audio")
+    (tmp_path / "again.webm").write_bytes(b"same audio")
+    fake_db = make_fake_db(
+        [{"_id": "first", "status": "pending", "audio_filename": "first.webm"}]
+    )
+
+    monkeypatch.setattr(
+        main, "load_waveform", lambda recording, audio_dir: main.torch.zeros(1, 16000)
+    )
+    monkeypatch.setattr(
+        main,
+        "estimate_pitches",
+        lambda waveforms, sample_rate: [(440.0, 0.9) for _ in waveforms],
+    )
+
+    main.process_pending_recordings(fake_db, fake_db.recordings.docs, tmp_path)
+
+    digest = main.file_digest(tmp_path / "first.webm")
+    cached = fake_db.pitch_cache.analyses[f"torchcrepe-tiny:{digest}"]
+    assert cached["pitch_note"] == "A4"
+
+    def fail_estimate(waveforms, sample_rate):
+        raise AssertionError("cached audio should not be analyzed again")
+
+    monkeypatch.setattr(main, "estimate_pitches", fail_estimate)
+    duplicate = {"_id": "again", "status": "pending", "audio_filename": "again.webm"}
+    fake_db.recordings.docs.append(duplicate)
+
+    main.process_pending_recordings(fake_db, [duplicate], tmp_path)
+
+    assert duplicate["status"] == "done"
+    assert duplicate["analysis"]["pitch_note"] == "A4"
+
+    # Analyses from another model are not reused.
+    monkeypatch.setattr(main, "ANALYSIS_METHOD", "torchcrepe-full")
+    other_model = {"_id": "full", "status": "pending", "audio_filename": "again.webm"}
+    fake_db.recordings.docs.append(other_model)
+
+    monkeypatch.setattr(
+        main,
+        "estimate_pitches",
+        lambda waveforms, sample_rate: [(220.0, 0.9) for _ in waveforms],
+    )
+
+    main.process_pending_recordings(fake_db, [other_model], tmp_path)
+
+    assert other_model["analysis"]["pitch_note"] == "A3"
+
+
+def test_process_pending_recordings_saves_results_when_caching_fails(
+    tmp_path, monkeypatch, make_fake_db, capsys
+):
+    (tmp_path / "clip.webm").write_bytes(b"audio")
+    fake_db = make_fake_db(
+        [{"_id": "clip", "status": "pending", "audio_filename": "clip.webm"}]
+    )
+
+    def racing_upsert(requests, ordered=True):  # pylint: disable=unused-argument
+        raise main.BulkWriteError({"writeErrors": [{"errmsg": "E11000 duplicate"}]})
+
+    monkeypatch.setattr(fake_db.pitch_cache, "bulk_write", racing_upsert)
+    monkeypatch.setattr(
+        main, "load_waveform", lambda recording, audio_dir: main.torch.zeros(1, 16000)
+    )
+    monkeypatch.setattr(
+        main,
+        "estimate_pitches",
+        lambda waveforms, sample_rate: [(440.0, 0.9) for _ in waveforms],
+    )
+
+    main.process_pending_recordings(fake_db, fake_db.recordings.docs, tmp_path)
+
+    assert fake_db.recordings.docs[0]["status"] == "done"
+    assert "Could not cache analyses" in capsys.readouterr().out
+
+
+def test_drain_decodes_next_batch_before_running_current_one(
+    tmp_path, monkeypatch, make_fake_db
+):
+    docs = [
+        {"_id": "first", "status": "pending", "audio_filename": "a.webm"},
+        {"_id": "second", "status": "pending", "audio_filename": "b.webm"},
+    ]
+    fake_db = make_fake_db(docs)
+    events = []
+
+    class RecordingPool:
+        """Decode pool that logs submissions and runs them inline."""
+
+        @staticmethod
+        def submit(func, recording, audio_dir):
+            events.append(f"decode {recording['_id']}")
+            future = main.Future()
+            future.set_result(func(recording, audio_dir))
+            return future
+
+    def fake_estimate(waveforms, sample_rate):  # pylint: disable=unused-argument
+        events.append("estimate")
+        return [(440.0, 0.9) for _ in waveforms]
+
+    monkeypatch.setattr(main, "PENDING_BATCH_LIMIT", 1)
+    monkeypatch.setattr(main, "_DECODE_POOL", RecordingPool)
+    monkeypatch.setattr(
+        main, "load_waveform", lambda recording, audio_dir: main.torch.zeros(1, 16000)
+    )
+    monkeypatch.setattr(main, "estimate_pitches", fake_estimate)
+
+    main.drain_pending_recordings(fake_db, tmp_path)
+
+    assert events == ["decode first", "decode second", "estimate", "estimate"]
+    assert [doc["status"] for doc in docs] == ["done", "done"]
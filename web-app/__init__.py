@@ -3,11 +3,15 @@
 # pylint: disable=invalid-name, import-error
 
 import os
+import threading
+import orjson
 from dotenv import load_dotenv
 from flask import Flask, current_app
+from flask.json.provider import DefaultJSONProvider
 from flask_login import LoginManager
 from bson import ObjectId
 from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 from routes import bp as main_bp
 from routes import User
 
@@ -16,6 +20,40 @@ load_dotenv()
 login_manager = LoginManager()
 
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson.
+
+    datetimes come out as ISO 8601 strings natively; anything else orjson
+    does not know (e.g. ObjectId) is passed through str().
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=str).decode()  # pylint: disable=no-member
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)  # pylint: disable=no-member
+
+
+def ensure_indexes(db, logger) -> None:
+    """Create the indexes the routes rely on (no-op if they exist).
+
+    Failures are logged, not raised: the app serves without the indexes,
+    just more slowly, until someone fixes the data or the connection.
+    """
+    indexes = [
+        # Per-user history, newest first.
+        (db.recordings, [("user_id", 1), ("created_at", -1)], {}),
+        # Login lookups; also stops two concurrent signups taking one name.
+        # Fails if older check-then-insert signups left duplicate names.
+        (db.users, [("username", 1)], {"unique": True}),
+    ]
+    for collection, keys, options in indexes:
+        try:
+            collection.create_index(keys, **options)
+        except PyMongoError as exc:
+            logger.warning("Could not create index %s: %s", keys, exc)
+
+
 def create_app() -> Flask:
     """Create and configure the flask application."""
     app = Flask(
@@ -24,6 +62,7 @@ def create_app() -> Flask:
         static_folder="static",
     )
 
+    app.json = OrjsonProvider(app)
     app.secret_key = os.getenv("SECRET_KEY", "to change in real deployment")
 
     login_manager.init_app(app)
@@ -37,9 +76,18 @@ def create_app() -> Flask:
     client = MongoClient(mongo_uri)
     db_name = os.getenv("MONGO_DB_NAME", "pitchdb")
     app.db = client[db_name]
+    # In the background so app start (and every gunicorn worker import)
+    # stays lazy about the connection, as MongoClient itself is.
+    threading.Thread(
+        target=ensure_indexes, args=(app.db, app.logger), daemon=True
+    ).start()
     audio_dir = os.getenv("AUDIO_DIR", os.path.join("data", "recordings"))
     os.makedirs(audio_dir, exist_ok=True)
     app.config["AUDIO_DIR"] = audio_dir
+    # Only behind a front end that honours X-Sendfile (Apache mod_xsendfile,
+    # lighttpd) and can read AUDIO_DIR; otherwise recordings come back empty.
+    # nginx wants X-Accel-Redirect instead, which Flask does not emit.
+    app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "0") == "1"
 
     app.register_blueprint(main_bp)
 
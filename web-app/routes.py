@@ -1,10 +1,11 @@
 """Flask routes for the pitch detector web app."""
 
 import os
-import uuid
+import shutil
 from datetime import datetime
 from bson import ObjectId
 from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import (
     Blueprint,
@@ -24,12 +25,27 @@ from flask_login import (
 
 bp = Blueprint("main", __name__)
 
+# Uploads are copied to disk in 1 MiB chunks rather than Werkzeug's 16 KiB.
+UPLOAD_COPY_BUFFER_BYTES = 1 << 20
+
+# The fields list_recordings actually returns.
+RECORDING_LIST_PROJECTION = {
+    "_id": 1,
+    "created_at": 1,
+    "status": 1,
+    "audio_filename": 1,
+    "analysis.pitch_hz": 1,
+    "analysis.pitch_note": 1,
+    "analysis.confidence": 1,
+}
+
 
 class User(UserMixin):
     """User class for Flask-Login."""
 
     def __init__(self, doc):
-        self.id = str(doc["_id"])
+        self.id = str(doc["_id"])  # Flask-Login wants a string
+        self.oid = doc["_id"]  # the ObjectId itself, for queries
         self.username = doc["username"]
 
 
@@ -55,7 +71,9 @@ def api_signup():
     if existing:
         return jsonify({"message": "Username already taken"}), 400
 
-    password_hash = generate_password_hash(password)
+    password_hash = generate_password_hash(
+        password, method=current_app.config.get("PASSWORD_HASH_METHOD", "scrypt")
+    )
 
     user_doc = {
         "username": username,
@@ -63,7 +81,11 @@ def api_signup():
         "created_at": datetime.utcnow(),
     }
 
-    result = db.users.insert_one(user_doc)
+    try:
+        result = db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        # Lost a race with another signup for the same name.
+        return jsonify({"message": "Username already taken"}), 400
 
     return (
         jsonify(
@@ -127,18 +149,20 @@ def upload_audio():
 
     # create a random filename with same extension
     ext = os.path.splitext(file.filename)[1] or ".webm"
-    filename = f"{uuid.uuid4().hex}{ext}"
+    filename = f"{os.urandom(16).hex()}{ext}"
 
     audio_dir = current_app.config["AUDIO_DIR"]
     save_path = os.path.join(audio_dir, filename)
-    file.save(save_path)
+    with open(save_path, "wb", buffering=0) as out:
+        shutil.copyfileobj(file.stream, out, length=UPLOAD_COPY_BUFFER_BYTES)
 
     db = current_app.db  # type: ignore[attr-defined]
 
+    now = datetime.utcnow()
     doc = {
-        "user_id": ObjectId(current_user.id),
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow(),
+        "user_id": current_user.oid,
+        "created_at": now,
+        "updated_at": now,
         "source": "mic",
         "audio_filename": filename,
         "duration_s": None,  # can be filled later by frontend
@@ -173,9 +197,7 @@ def get_recording(recording_id: str):
         {
             "id": recording_id,
             "status": doc.get("status"),
-            "created_at": (
-                doc.get("created_at").isoformat() if doc.get("created_at") else None
-            ),
+            "created_at": doc.get("created_at"),
             "audio_filename": doc.get("audio_filename"),
             "audio_url": f"/recordings/{doc.get('audio_filename')}",
             "analysis": {
@@ -195,7 +217,7 @@ def list_recordings():
     db = current_app.db
 
     cursor = (
-        db.recordings.find({"user_id": ObjectId(current_user.id)})
+        db.recordings.find({"user_id": current_user.oid}, RECORDING_LIST_PROJECTION)
         .sort("created_at", -1)
         .limit(20)
     )
@@ -207,9 +229,7 @@ def list_recordings():
         recordings.append(
             {
                 "id": rec_id,
-                "created_at": (
-                    doc.get("created_at").isoformat() if doc.get("created_at") else None
-                ),
+                "created_at": doc.get("created_at"),
                 "status": doc.get("status"),
                 "audio_filename": doc.get("audio_filename"),
                 "audio_url": f"/recordings/{doc.get('audio_filename')}",
@@ -1,4 +1,8 @@
-"""Entry point for running the pitch detector web app."""
+"""Entry point for running the pitch detector web app.
+
+``python run.py`` starts Flask's development server; the Docker image
+serves ``run:app`` with gunicorn instead.
+"""
 
 # pylint: disable=import-error
 
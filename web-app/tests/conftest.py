@@ -5,12 +5,19 @@
 # a couple of pylint rules here.
 # pylint: disable=too-few-public-methods, redefined-outer-name
 
+from datetime import datetime
+from operator import itemgetter
 from pathlib import Path
 import os
+import shutil
 import sys
+import tempfile
 
 import pytest
 from bson import ObjectId
+from werkzeug.security import generate_password_hash
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
 
 # Make sure the parent directory (containing __init__.py) is on the path
 ROOT = Path(__file__).resolve().parents[1]
@@ -19,6 +26,9 @@ if str(ROOT) not in sys.path:
 
 from __init__ import create_app  # pylint: disable=import-error, wrong-import-position
 
+# A single PBKDF2 round: tests need working hashes, not slow ones.
+TEST_PASSWORD_HASH_METHOD = "pbkdf2:sha256:1"
+
 
 class FakeInsertResult:
     """Simple stand-in for pymongo's InsertOneResult."""
@@ -27,6 +37,13 @@ class FakeInsertResult:
         self.inserted_id = inserted_id
 
 
+class FakeInsertManyResult:
+    """Simple stand-in for pymongo's InsertManyResult."""
+
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+
+
 class FakeCursor:
     """Chainable cursor supporting sort().limit() and iteration."""
 
@@ -35,8 +52,8 @@ class FakeCursor:
 
     def sort(self, key, direction):
         """Sort the stored docs by key and return self."""
-        reverse = direction == -1
-        self._docs.sort(key=lambda d: d.get(key), reverse=reverse)
+        if len(self._docs) > 1:
+            self._docs.sort(key=itemgetter(key), reverse=direction == -1)
         return self
 
     def limit(self, count):
@@ -48,35 +65,77 @@ class FakeCursor:
         return iter(self._docs)
 
 
+def _project(document, projection):
+    """Apply an inclusion projection (dotted paths allowed) to a document."""
+    projected = {"_id": document["_id"]}
+    for path in projection:
+        source, target = document, projected
+        *parents, leaf = path.split(".")
+        for key in parents:
+            source = source.get(key)
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(key, {})
+        else:
+            if leaf in source:
+                target[leaf] = source[leaf]
+    return projected
+
+
 class FakeCollection:
-    """Minimal subset of the pymongo Collection API used by our routes."""
+    """Minimal subset of the pymongo Collection API used by our routes.
+
+    Documents are also indexed by _id and username, so the single-key
+    lookups the routes and Flask-Login's user loader make are dict hits.
+    """
+
+    _INDEXED_FIELDS = ("_id", "username")
 
     def __init__(self):
         self.docs = []
+        self.indexes = {field: {} for field in self._INDEXED_FIELDS}
+        self.created_indexes = []
 
     def insert_one(self, doc):
         """Insert a document and assign an _id if missing."""
         new_doc = dict(doc)
         new_doc.setdefault("_id", ObjectId())
         self.docs.append(new_doc)
+        for field, index in self.indexes.items():
+            if field in new_doc:
+                index.setdefault(new_doc[field], new_doc)
         return FakeInsertResult(new_doc["_id"])
 
+    def insert_many(self, docs):
+        """Insert several documents, assigning _ids where missing."""
+        return FakeInsertManyResult([self.insert_one(doc).inserted_id for doc in docs])
+
     def find_one(self, query):
         """Return the first document matching the query, or None."""
+        if len(query) == 1:
+            ((field, value),) = query.items()
+            if field in self.indexes:
+                return self.indexes[field].get(value)
         for document in self.docs:
             if all(document.get(k) == v for k, v in query.items()):
                 return document
         return None
 
-    def find(self, query):
+    def find(self, query, projection=None):
         """Return a cursor over documents matching the query."""
         matched = [
             document
             for document in self.docs
             if all(document.get(k) == v for k, v in query.items())
         ]
+        if projection is not None:
+            matched = [_project(document, projection) for document in matched]
         return FakeCursor(matched)
 
+    def create_index(self, keys, **kwargs):
+        """Record the requested index; the fake never needs it."""
+        self.created_indexes.append((keys, kwargs))
+
 
 class FakeDB:
     """Fake database object with users and recordings collections."""
@@ -86,21 +145,62 @@ class FakeDB:
         self.recordings = FakeCollection()
 
 
-@pytest.fixture
-def app(tmp_path):
-    """Create a Flask app instance with a fake DB and temp AUDIO_DIR."""
-    # These env vars are read by create_app, but the real Mongo server
-    # is never contacted because we immediately swap in FakeDB.
+class FakeMongoClient:
+    """Stand-in for pymongo's MongoClient that never opens a connection."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getitem__(self, name):
+        return FakeDB()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _no_real_mongo_client():
+    """Keep create_app from building a real MongoClient and its monitor threads."""
+    with pytest.MonkeyPatch.context() as patcher:
+        patcher.setattr("__init__.MongoClient", FakeMongoClient)
+        yield
+
+
+@pytest.fixture(scope="session")
+def _app_session(request, tmp_path_factory, _no_real_mongo_client):
+    """Build the Flask app once for the whole test session."""
+    # These env vars are read by create_app; MongoClient is stubbed out
+    # and each test swaps in its own FakeDB.
     os.environ["SECRET_KEY"] = "test-secret"
     os.environ["MONGO_URI"] = "mongodb://example"
     os.environ["MONGO_DB_NAME"] = "testdb"
-    os.environ["AUDIO_DIR"] = str(tmp_path)
+    # Named per xdist worker; plain runs (or no xdist at all) use "main".
+    worker = getattr(request.config, "workerinput", {}).get("workerid", "main")
+    if os.path.isdir("/dev/shm"):
+        # tmpfs keeps the upload/serve tests' file I/O in memory.
+        audio_dir = tempfile.mkdtemp(prefix=f"audio-{worker}-", dir="/dev/shm")
+    else:
+        audio_dir = str(tmp_path_factory.mktemp(f"audio-{worker}"))
+    os.environ["AUDIO_DIR"] = audio_dir
 
     flask_app = create_app()
     flask_app.config["TESTING"] = True
-    flask_app.db = FakeDB()  # swap in our fake DB
+    flask_app.config["PASSWORD_HASH_METHOD"] = TEST_PASSWORD_HASH_METHOD
+    yield flask_app
+
+    shutil.rmtree(audio_dir, ignore_errors=True)
+
 
-    return flask_app
+@pytest.fixture(autouse=True)
+def _reset_state(_app_session):
+    """Give every test a fresh fake DB and an empty AUDIO_DIR."""
+    _app_session.db = FakeDB()  # swap in our fake DB
+
+    for path in Path(_app_session.config["AUDIO_DIR"]).iterdir():
+        path.unlink()
+
+
+@pytest.fixture
+def app(_app_session):
+    """Return the shared session app."""
+    return _app_session
 
 
 @pytest.fixture
@@ -109,27 +209,42 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture
+def raw_get(app):
+    """Return a GET helper for stateless requests.
+
+    It drives the WSGI app through a bare werkzeug Client, skipping the
+    Flask test client's cookie jar and session handling.
+    """
+    return Client(app, Response, use_cookies=False).get
+
+
 @pytest.fixture
 def fake_db(app):
     """Return the FakeDB instance used by the app."""
     return app.db
 
 
+@pytest.fixture(scope="session")
+def alice_password_hash():
+    """Hash alice's password once; hashing is the slow part of signup."""
+    return generate_password_hash("secret", method=TEST_PASSWORD_HASH_METHOD)
+
+
 @pytest.fixture
-def auth_client(client):
-    """Test client with a logged-in user created via real signup/login routes."""
-    # Signup
-    resp = client.post(
-        "/api/signup",
-        json={"username": "alice", "password": "secret"},
+def auth_client(client, fake_db, alice_password_hash):
+    """Test client logged in as a user stored directly in the fake DB."""
+    result = fake_db.users.insert_one(
+        {
+            "username": "alice",
+            "password_hash": alice_password_hash,
+            "created_at": datetime.utcnow(),
+        }
     )
-    assert resp.status_code == 201
 
-    # Login
-    resp = client.post(
-        "/api/login",
-        json={"username": "alice", "password": "secret"},
-    )
-    assert resp.status_code == 200
+    # Log in the way Flask-Login would, without re-checking the password.
+    with client.session_transaction() as session:
+        session["_user_id"] = str(result.inserted_id)
+        session["_fresh"] = True
 
     return client
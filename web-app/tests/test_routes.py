@@ -2,83 +2,106 @@
 
 from datetime import datetime
 from io import BytesIO
+import logging
 import os
 
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+import pytest
 
+from __init__ import ensure_indexes  # pylint: disable=import-error
 
-def test_home_page_renders(client):
+# Fixed values for test documents that only need a timestamp or an owner.
+_NOW = datetime(2024, 1, 1)
+_DUMMY_OID = ObjectId("0" * 24)
+# Upload payload; wrapped in a fresh BytesIO at each post since posting reads it.
+_FAKE_AUDIO = b"fake-audio-bytes"
+
+
+def test_home_page_renders(raw_get):
     """Home page should return 200 and contain HTML."""
-    resp = client.get("/")
+    resp = raw_get("/")
     assert resp.status_code == 200
     assert b"<html" in resp.data
 
 
-def test_signup_validation(client):
+@pytest.mark.parametrize(
+    "existing, payload, status",
+    [
+        pytest.param(None, {}, 400, id="missing-fields"),
+        pytest.param(None, {"username": "bob", "password": "pw123"}, 201, id="ok"),
+        pytest.param(
+            "bob", {"username": "bob", "password": "another"}, 400, id="duplicate"
+        ),
+    ],
+)
+def test_signup_validation(client, fake_db, existing, payload, status):
     """Signup should validate missing fields and handle duplicates."""
-    # Missing username and password
-    resp = client.post("/api/signup", json={})
-    assert resp.status_code == 400
+    if existing:
+        fake_db.users.insert_one({"username": existing, "password_hash": "x"})
 
-    # Valid signup
+    resp = client.post("/api/signup", json=payload)
+    assert resp.status_code == status
+
+
+def test_signup_success(client, app, fake_db):
+    """Valid signup returns the new id and hashes with the configured method."""
     resp = client.post(
         "/api/signup",
         json={"username": "bob", "password": "pw123"},
     )
     assert resp.status_code == 201
-    data = resp.get_json()
-    assert "user_id" in data
+    assert "user_id" in resp.get_json()
 
-    # Duplicate username
-    resp2 = client.post(
-        "/api/signup",
-        json={"username": "bob", "password": "another"},
-    )
-    assert resp2.status_code == 400
+    stored = fake_db.users.find_one({"username": "bob"})
+    assert stored["password_hash"].startswith(app.config["PASSWORD_HASH_METHOD"] + "$")
 
 
-def test_login_validation(client):
-    """Login endpoint should check for credentials and invalid combos."""
-    # Need username + password
-    resp = client.post("/api/login", json={})
-    assert resp.status_code == 400
+def test_signup_reports_duplicate_key_as_taken(client, fake_db, monkeypatch):
+    """A unique-index violation on insert should look like a taken name."""
 
-    # Create a user to log in as
-    client.post("/api/signup", json={"username": "carol", "password": "pw"})
+    def raise_duplicate(doc):
+        raise DuplicateKeyError("E11000 duplicate key error")
 
-    # Wrong username
-    resp = client.post(
-        "/api/login",
-        json={"username": "nope", "password": "pw"},
-    )
-    assert resp.status_code == 401
+    monkeypatch.setattr(fake_db.users, "insert_one", raise_duplicate)
 
-    # Wrong password
-    resp = client.post(
-        "/api/login",
-        json={"username": "carol", "password": "wrong"},
-    )
-    assert resp.status_code == 401
+    resp = client.post("/api/signup", json={"username": "dave", "password": "pw"})
+    assert resp.status_code == 400
+    assert resp.get_json()["message"] == "Username already taken"
+
+
+@pytest.mark.parametrize(
+    "payload, status",
+    [
+        pytest.param({}, 400, id="missing-fields"),
+        pytest.param({"username": "nope", "password": "pw"}, 401, id="wrong-username"),
+        pytest.param(
+            {"username": "carol", "password": "wrong"}, 401, id="wrong-password"
+        ),
+        pytest.param({"username": "carol", "password": "pw"}, 200, id="ok"),
+    ],
+)
+def test_login_validation(client, payload, status):
+    """Login endpoint should check for credentials and invalid combos."""
+    # Create a user to log in as
+    client.post("/api/signup", json={"username": "carol", "password": "pw"})
 
-    # Correct credentials
-    resp = client.post(
-        "/api/login",
-        json={"username": "carol", "password": "pw"},
-    )
-    assert resp.status_code == 200
-    assert resp.get_json()["message"] == "Login successful"
+    resp = client.post("/api/login", json=payload)
+    assert resp.status_code == status
+    if status == 200:
+        assert resp.get_json()["message"] == "Login successful"
 
 
-def test_pitch_requires_login(client):
+def test_pitch_requires_login(raw_get):
     """Pitch page should redirect anonymous users to the login page."""
-    resp = client.get("/pitch")
+    resp = raw_get("/pitch")
     assert resp.status_code == 302
     assert "/" in resp.headers["Location"]
 
 
-def test_history_requires_login(client):
+def test_history_requires_login(raw_get):
     """History page should also redirect anonymous users."""
-    resp = client.get("/history")
+    resp = raw_get("/history")
     assert resp.status_code == 302
 
 
@@ -89,17 +112,21 @@ def test_pitch_page_after_login(auth_client):
     assert b"Record Your Voice" in resp.data
 
 
-def test_upload_audio_validation(auth_client):
+@pytest.mark.parametrize(
+    "audio_filename",
+    [
+        pytest.param(None, id="no-audio-field"),
+        pytest.param("", id="empty-filename"),
+    ],
+)
+def test_upload_audio_validation(auth_client, audio_filename):
     """Upload endpoint should validate missing/empty audio fields."""
-    # No 'audio' field
-    resp = auth_client.post("/api/upload", data={})
-    assert resp.status_code == 400
+    data = {}
+    if audio_filename is not None:
+        data["audio"] = (BytesIO(_FAKE_AUDIO), audio_filename)
 
-    # Empty filename
     resp = auth_client.post(
-        "/api/upload",
-        data={"audio": (BytesIO(b"test"), "")},
-        content_type="multipart/form-data",
+        "/api/upload", data=data, content_type="multipart/form-data"
     )
     assert resp.status_code == 400
 
@@ -110,7 +137,7 @@ def test_upload_audio_success(auth_client, app, fake_db):
 
     resp = auth_client.post(
         "/api/upload",
-        data={"audio": (BytesIO(b"fake-audio-bytes"), "sample.webm")},
+        data={"audio": (BytesIO(_FAKE_AUDIO), "sample.webm")},
         content_type="multipart/form-data",
     )
     assert resp.status_code == 201
@@ -119,33 +146,36 @@ def test_upload_audio_success(auth_client, app, fake_db):
     assert data["status"] == "pending"
 
     # File should have been written into AUDIO_DIR
-    files = os.listdir(audio_dir)
-    assert len(files) == 1
+    with os.scandir(audio_dir) as entries:
+        (saved,) = entries  # exactly one file
+    with open(saved.path, "rb") as file:
+        assert file.read() == _FAKE_AUDIO
 
     # DB should contain the new recording
     doc = fake_db.recordings.find_one({"_id": ObjectId(rec_id)})
     assert doc is not None
     assert doc["status"] == "pending"
+    assert doc["user_id"] == fake_db.users.docs[0]["_id"]
 
 
-def test_get_recording_invalid_id(client):
+def test_get_recording_invalid_id(raw_get):
     """Invalid ObjectId should return 400."""
-    resp = client.get("/api/recordings/not-an-objectid")
+    resp = raw_get("/api/recordings/not-an-objectid")
     assert resp.status_code == 400
 
 
-def test_get_recording_not_found(client):
+def test_get_recording_not_found(raw_get):
     """Valid ObjectId with no DB entry should return 404."""
-    resp = client.get(f"/api/recordings/{ObjectId()}")
+    resp = raw_get(f"/api/recordings/{ObjectId()}")
     assert resp.status_code == 404
 
 
 def test_get_recording_success(auth_client, fake_db):
     """Happy-path fetch of an existing recording."""
     rec_doc = {
-        "user_id": ObjectId(),
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow(),
+        "user_id": _DUMMY_OID,
+        "created_at": _NOW,
+        "updated_at": _NOW,
         "status": "done",
         "audio_filename": "foo.webm",
         "analysis": {
@@ -164,6 +194,7 @@ def test_get_recording_success(auth_client, fake_db):
     assert data["id"] == rec_id
     assert data["analysis"]["pitch_note"] == "A4"
     assert data["analysis"]["pitch_hz"] == 440.0
+    assert data["created_at"] == rec_doc["created_at"].isoformat()
 
 
 def test_list_recordings_filters_by_user(auth_client, fake_db):
@@ -171,25 +202,25 @@ def test_list_recordings_filters_by_user(auth_client, fake_db):
     assert fake_db.users.docs  # created by /api/signup in auth_client
     user_id = fake_db.users.docs[0]["_id"]
 
-    # Recording for this user
-    fake_db.recordings.insert_one(
-        {
-            "user_id": user_id,
-            "created_at": datetime.utcnow(),
-            "status": "done",
-            "audio_filename": "mine.webm",
-            "analysis": {"pitch_note": "C4", "pitch_hz": 261.6, "confidence": 0.8},
-        }
-    )
-    # Recording for another user should be ignored
-    fake_db.recordings.insert_one(
-        {
-            "user_id": ObjectId(),
-            "created_at": datetime.utcnow(),
-            "status": "done",
-            "audio_filename": "theirs.webm",
-            "analysis": {},
-        }
+    fake_db.recordings.insert_many(
+        [
+            # Recording for this user
+            {
+                "user_id": user_id,
+                "created_at": _NOW,
+                "status": "done",
+                "audio_filename": "mine.webm",
+                "analysis": {"pitch_note": "C4", "pitch_hz": 261.6, "confidence": 0.8},
+            },
+            # Recording for another user should be ignored
+            {
+                "user_id": _DUMMY_OID,
+                "created_at": _NOW,
+                "status": "done",
+                "audio_filename": "theirs.webm",
+                "analysis": {},
+            },
+        ]
     )
 
     resp = auth_client.get("/api/recordings")
@@ -198,6 +229,23 @@ def test_list_recordings_filters_by_user(auth_client, fake_db):
     recs = data["recordings"]
     assert len(recs) == 1
     assert recs[0]["audio_filename"] == "mine.webm"
+    assert recs[0]["analysis"]["pitch_note"] == "C4"
+
+
+def test_authenticated_request_loads_user_once(auth_client, fake_db, monkeypatch):
+    """login_required plus current_user access should hit the users collection once."""
+    lookups = []
+    find_one = fake_db.users.find_one
+
+    def counting_find_one(query):
+        lookups.append(query)
+        return find_one(query)
+
+    monkeypatch.setattr(fake_db.users, "find_one", counting_find_one)
+
+    resp = auth_client.get("/api/recordings")
+    assert resp.status_code == 200
+    assert len(lookups) == 1
 
 
 def test_serve_recording(auth_client, app):
@@ -213,6 +261,19 @@ def test_serve_recording(auth_client, app):
     assert resp.data == b"12345"
 
 
+def test_serve_recording_with_x_sendfile(auth_client, app, monkeypatch):
+    """With USE_X_SENDFILE the file is handed to the front-end server."""
+    monkeypatch.setitem(app.config, "USE_X_SENDFILE", True)
+    path = os.path.join(app.config["AUDIO_DIR"], "clip.webm")
+    with open(path, "wb") as file:
+        file.write(b"12345")
+
+    resp = auth_client.get("/recordings/clip.webm")
+    assert resp.status_code == 200
+    assert resp.headers["X-Sendfile"] == path
+    assert resp.data == b""
+
+
 def test_logout(auth_client):
     """Logout should clear the session so protected pages redirect again."""
     resp = auth_client.post("/api/logout")
@@ -220,3 +281,20 @@ def test_logout(auth_client):
 
     resp2 = auth_client.get("/pitch")
     assert resp2.status_code == 302
+
+
+def test_ensure_indexes_logs_instead_of_raising(app, fake_db, monkeypatch, caplog):
+    """A failing index build should be logged and not stop the others."""
+
+    def raise_duplicate(keys, **kwargs):
+        raise DuplicateKeyError("E11000 duplicate key error")
+
+    monkeypatch.setattr(fake_db.users, "create_index", raise_duplicate)
+
+    with caplog.at_level(logging.WARNING):
+        ensure_indexes(fake_db, app.logger)
+
+    assert fake_db.recordings.created_indexes == [
+        ([("user_id", 1), ("created_at", -1)], {})
+    ]
+    assert "duplicate key" in caplog.text